@@ -1,12 +1,9 @@
 import streamlit as st
 import pandas as pd
-from docx import Document
-from docx.shared import Pt, Inches
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.enum.section import WD_ORIENT
-from docx.oxml.ns import qn
-from docx.oxml import OxmlElement
+import numpy as np
+from xml.sax.saxutils import escape
 import io
+import functools
 
 # --- Helper: Bloom's Taxonomy Distribution (default for 30 items) ---
 BLOOM_DISTRIBUTION = {
@@ -28,6 +25,50 @@ BLOOM_VERBS = {
     "Creating": ["design", "construct", "develop", "propose", "formulate"]
 }
 
+# --- Item Type & Point Value per Bloom's Level ---
+LEVEL_META = {
+    "Remembering": ("Multiple Choice", 1),
+    "Understanding": ("Multiple Choice", 1),
+    "Applying": ("Short Answer", 2),
+    "Analyzing": ("Short Answer", 2),
+    "Evaluating": ("Essay", 5),
+    "Creating": ("Essay", 5)
+}
+ITEM_TYPES = ["Multiple Choice", "Short Answer", "Essay"]
+
+# --- Quiz item templates & sample answers per item type ---
+MCQ_TEMPLATE = (
+    "{verb} the following:\nWhat is the primary characteristic of mechanical waves?\n"
+    "A. They can travel through vacuum.\n"
+    "B. They require a medium to propagate.\n"
+    "C. They are always transverse.\n"
+    "D. They travel faster than light.\n"
+)
+SHORT_TEMPLATE = (
+    "{verb} how sound waves carry energy through air.\n"
+    "(2–3 sentences)\n"
+)
+ESSAY_TEMPLATE = "{verb} an experiment to demonstrate wave reflection and refraction using everyday materials. Justify your design choices.\n"
+QUIZ_TEMPLATES = {
+    "Multiple Choice": MCQ_TEMPLATE,
+    "Short Answer": SHORT_TEMPLATE,
+    "Essay": ESSAY_TEMPLATE
+}
+
+MCQ_ANSWER = "✓ B"
+SHORT_ANSWER = "[Sample] Sound waves carry energy by compressing and rarefying air particles, transferring kinetic energy from one particle to the next."
+ESSAY_RUBRIC = (
+    "[Rubric: 5 pts total]\n"
+    "• Content (3 pts): Accurate science, clear steps\n"
+    "• Organization (1 pt): Logical flow\n"
+    "• Mechanics (1 pt): Grammar, spelling\n"
+)
+QUIZ_ANSWERS = {
+    "Multiple Choice": MCQ_ANSWER,
+    "Short Answer": SHORT_ANSWER,
+    "Essay": ESSAY_RUBRIC
+}
+
 # --- Fake but realistic sample MELC bank (for demo & validation) ---
 MELC_DATABASE = {
     "Mathematics": {
@@ -68,8 +109,34 @@ MELC_DATABASE = {
     }
 }
 
+# --- Flat (subject, grade, quarter) -> MELC list index ---
+_MELC_FLAT = {
+    (subject, grade, quarter): melcs
+    for subject, grades in MELC_DATABASE.items()
+    for grade, quarters in grades.items()
+    for quarter, melcs in quarters.items()
+}
+
+# --- Flat (subject, grade) -> quarter list index ---
+_MELC_QUARTERS = {
+    (subject, grade): list(quarters)
+    for subject, grades in MELC_DATABASE.items()
+    for grade, quarters in grades.items()
+}
+
+# --- Cached MELC lookups for the UI selectboxes ---
+@st.cache_resource
+def _get_subjects():
+    return list(MELC_DATABASE.keys())
+
+def _get_quarters(subject, grade):
+    return _MELC_QUARTERS.get((subject, grade), [])
+
 # --- Utility: Add heading with style ---
 def add_heading(doc, text, level=1):
+    from docx.shared import Pt
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    
     p = doc.add_paragraph()
     p.style = f'Heading {level}'
     run = p.add_run(text)
@@ -80,110 +147,115 @@ def add_heading(doc, text, level=1):
         run.font.size = Pt(14)
     p.alignment = WD_ALIGN_PARAGRAPH.CENTER
 
-# --- Utility: Set cell borders ---
-def set_cell_borders(cell, **kwargs):
-    tc = cell._element
-    tcPr = tc.get_or_add_tcPr()
-    tcBorders = OxmlElement('w:tcBorders')
-    for border_name in ["top", "left", "bottom", "right"]:
-        value = kwargs.get(border_name, "single")
-        if value:
-            border = OxmlElement(f'w:{border_name}')
-            border.set(qn('w:val'), value)
-            border.set(qn('w:sz'), '4')
-            border.set(qn('w:space'), '0')
-            border.set(qn('w:color'), 'auto')
-            tcBorders.append(border)
-    tcPr.append(tcBorders)
+# --- WordprocessingML namespace declaration for bulk-built XML ---
+W_NSDECL = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+
+# --- Shared parser for bulk-built XML (keeps python-docx element classes) ---
+@functools.lru_cache(maxsize=None)
+def _get_wml_parser():
+    from docx.oxml.parser import element_class_lookup
+    from lxml.etree import XMLParser, fromstring
+    
+    parser = XMLParser(remove_blank_text=False, resolve_entities=False, huge_tree=True)
+    parser.set_element_class_lookup(element_class_lookup)
+    return functools.partial(fromstring, parser=parser)
+
+# --- Utility: Parse bulk-built XML with the shared parser ---
+def parse_wml(xml):
+    return _get_wml_parser()(xml)
+
+# --- Border XML template ---
+BORDER_XML = '<w:{side} w:val="{value}" w:sz="4" w:space="0" w:color="auto"/>'
+
+# --- Table-level borders (inherited by every cell) ---
+TBL_BORDERS_XML = "<w:tblBorders>" + "".join(
+    BORDER_XML.format(side=side, value="single")
+    for side in ["top", "left", "bottom", "right", "insideH", "insideV"]
+) + "</w:tblBorders>"
+
+# --- Utility: Build a text run as raw XML (tabs become w:tab, newlines w:br) ---
+def run_xml(text, bold=False):
+    rpr = "<w:rPr><w:b/></w:rPr>" if bold else ""
+    lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    content = "<w:br/>".join(
+        "<w:tab/>".join(f'<w:t xml:space="preserve">{escape(chunk)}</w:t>' for chunk in line.split("\t"))
+        for line in lines
+    )
+    return f"<w:r>{rpr}{content}</w:r>"
+
+# --- Utility: Build a table cell as raw XML ---
+def tc_xml(text, width, bold=False):
+    run = run_xml(text, bold) if text else ""
+    return f'<w:tc><w:tcPr><w:tcW w:w="{width}" w:type="dxa"/></w:tcPr><w:p>{run}</w:p></w:tc>'
+
+# --- Utility: Append raw XML elements to the document body (before sectPr) ---
+def append_body_xml(doc, xml):
+    fragment = parse_wml(f"<w:body {W_NSDECL}>{xml}</w:body>")
+    body = doc.element.body
+    for element in list(fragment):
+        if body.sectPr is not None:
+            body.sectPr.addprevious(element)
+        else:
+            body.append(element)
 
 # --- Generate TOS DataFrame ---
+@st.cache_data(show_spinner=False, max_entries=100, ttl=3600)
 def generate_tos(competencies, total_items=30):
+    bloom_levels = list(BLOOM_DISTRIBUTION)
+    bloom_weights = np.array(list(BLOOM_DISTRIBUTION.values()))
+    applying = bloom_levels.index("Applying")
+    creating = bloom_levels.index("Creating")
+
     # Compute item count per cognitive level
-    counts = {level: round(BLOOM_DISTRIBUTION[level] * total_items) for level in BLOOM_DISTRIBUTION}
+    counts = np.round(bloom_weights * total_items).astype(int)
     
     # Adjust to ensure sum = total_items (rounding may cause ±1 error)
-    diff = total_items - sum(counts.values())
+    diff = total_items - counts.sum()
     if diff > 0:
-        counts["Applying"] += diff
+        counts[applying] += diff
     elif diff < 0:
-        counts["Creating"] += diff  # reduce least-weighted
+        counts[creating] += diff  # reduce least-weighted
 
-    rows = []
-    item_no = 1
+    # Assign ~equal share per competency (or more to earlier ones if uneven)
+    n_comp = len(competencies)
+    shares = np.full(n_comp, total_items // n_comp)
+    shares[:total_items % n_comp] += 1
     
-    # Distribute items across competencies & Bloom's levels
-    for comp in competencies:
-        # Assign ~equal share (or more to earlier ones if uneven)
-        comp_items = total_items // len(competencies)
-        extra = 1 if competencies.index(comp) < total_items % len(competencies) else 0
-        comp_items += extra
-        
-        # Distribute this comp’s items across Bloom's levels
-        comp_counts = {level: round(counts[level] * comp_items / total_items) for level in counts}
-        comp_diff = comp_items - sum(comp_counts.values())
-        if comp_diff > 0:
-            comp_counts["Applying"] += comp_diff
-        
-        for level, n in comp_counts.items():
-            for _ in range(n):
-                # Determine item type by Bloom's level
-                if level in ["Remembering", "Understanding"]:
-                    item_type = "Multiple Choice"
-                elif level in ["Applying", "Analyzing"]:
-                    item_type = "Short Answer"
-                else:  # Evaluating, Creating
-                    item_type = "Essay"
-                
-                point_val = 1 if item_type == "Multiple Choice" else (2 if item_type == "Short Answer" else 5)
-                
-                rows.append({
-                    "Item No.": item_no,
-                    "Cognitive Level": level,
-                    "Competency (MELC)": f"{comp['code']}: {comp['desc']}",
-                    "Item Type": item_type,
-                    "Point Value": point_val,
-                    "Remarks": ""
-                })
-                item_no += 1
-    return pd.DataFrame(rows)
+    # Distribute each comp’s items across Bloom's levels (one row per comp)
+    comp_counts = np.round(np.outer(shares, counts) / total_items).astype(int)
+    comp_diff = shares - comp_counts.sum(axis=1)
+    comp_counts[:, applying] += np.maximum(comp_diff, 0)
+    
+    # Materialize one level code per item, ordered by competency then level
+    level_codes = np.repeat(np.tile(np.arange(len(bloom_levels)), n_comp), comp_counts.ravel())
+    labels = [f"{comp['code']}: {comp['desc']}" for comp in competencies]
+    comp_col = np.repeat(np.array(labels, dtype=object), comp_counts.sum(axis=1))
+    
+    # Look up item type and points by Bloom's level
+    type_codes = np.array([ITEM_TYPES.index(LEVEL_META[level][0]) for level in bloom_levels])
+    point_vals = np.array([LEVEL_META[level][1] for level in bloom_levels])
+    
+    return pd.DataFrame({
+        "Item No.": np.arange(1, len(level_codes) + 1),
+        "Cognitive Level": pd.Categorical.from_codes(level_codes, bloom_levels),
+        "Competency (MELC)": comp_col,
+        "Item Type": pd.Categorical.from_codes(type_codes[level_codes], ITEM_TYPES),
+        "Point Value": point_vals[level_codes],
+        "Remarks": ""
+    })
 
 # --- Generate quiz items ---
+@st.cache_data(show_spinner=False, max_entries=100, ttl=3600)
 def generate_quiz_items(tos_df):
     items = []
-    for _, row in tos_df.iterrows():
-        comp_code = row["Competency (MELC)"].split(":")[0].strip()
-        level = row["Cognitive Level"]
-        item_type = row["Item Type"]
-        points = row["Point Value"]
-        
+    for item_no, level, _, item_type, points, _ in tos_df.itertuples(index=False, name=None):
         verb = BLOOM_VERBS[level][0].capitalize()
-        topic = "waves" if "S8FE" in comp_code else "algebraic expressions" if "M8AL" in comp_code else "information"
-        
-        item_text = ""
-        answer = ""
         
-        if item_type == "Multiple Choice":
-            item_text = f"{verb} the following:\nWhat is the primary characteristic of mechanical waves?\n"
-            item_text += "A. They can travel through vacuum.\n"
-            item_text += "B. They require a medium to propagate.\n"
-            item_text += "C. They are always transverse.\n"
-            item_text += "D. They travel faster than light.\n"
-            answer = "✓ B"
-        elif item_type == "Short Answer":
-            item_text = f"{verb} how sound waves carry energy through air.\n"
-            item_text += "(2–3 sentences)\n"
-            answer = "[Sample] Sound waves carry energy by compressing and rarefying air particles, transferring kinetic energy from one particle to the next."
-        else:  # Essay
-            item_text = f"{verb} an experiment to demonstrate wave reflection and refraction using everyday materials. Justify your design choices.\n"
-            answer = (
-                "[Rubric: 5 pts total]\n"
-                "• Content (3 pts): Accurate science, clear steps\n"
-                "• Organization (1 pt): Logical flow\n"
-                "• Mechanics (1 pt): Grammar, spelling\n"
-            )
+        item_text = QUIZ_TEMPLATES[item_type].format(verb=verb)
+        answer = QUIZ_ANSWERS[item_type]
         
         items.append({
-            "item_no": row["Item No."],
+            "item_no": item_no,
             "text": item_text,
             "answer": answer,
             "points": points
@@ -192,6 +264,12 @@ def generate_quiz_items(tos_df):
 
 # --- Create Word Document ---
 def create_word_doc(tos_df, quiz_items, metadata):
+    from docx import Document
+    from docx.shared import Inches, Emu
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    from docx.enum.section import WD_ORIENT
+    
+    total_points = int(tos_df["Point Value"].sum())
     doc = Document()
     
     # === Cover Page ===
@@ -216,46 +294,41 @@ def create_word_doc(tos_df, quiz_items, metadata):
     # === TOS Table ===
     add_heading(doc, "I. TABLE OF SPECIFICATIONS", 2)
     
-    # Create table
-    table = doc.add_table(rows=1, cols=6)
-    table.style = 'Table Grid'
-    hdr_cells = table.rows[0].cells
+    # Build the whole table as one XML block; borders come from tblBorders
     headers = ["Item No.", "Cognitive Level", "Competency (MELC)", "Item Type", "Point Value", "Remarks"]
-    for i, header in enumerate(headers):
-        hdr_cells[i].text = header
-        hdr_cells[i].paragraphs[0].runs[0].bold = True
-        set_cell_borders(hdr_cells[i])
-    
-    # Populate rows
-    for _, row in tos_df.iterrows():
-        cells = table.add_row().cells
-        cells[0].text = str(row["Item No."])
-        cells[1].text = row["Cognitive Level"]
-        cells[2].text = row["Competency (MELC)"]
-        cells[3].text = row["Item Type"]
-        cells[4].text = str(row["Point Value"])
-        cells[5].text = row["Remarks"]
-        for cell in cells:
-            set_cell_borders(cell)
+    col_width = Emu(section.page_width - section.left_margin - section.right_margin).twips // len(headers)
+    header_row = "".join(tc_xml(header, col_width, bold=True) for header in headers)
+    body_rows = "".join(
+        "<w:tr>" + "".join(tc_xml(str(val), col_width) for val in row) + "</w:tr>"
+        for row in tos_df.itertuples(index=False, name=None)
+    )
+    grid = f'<w:gridCol w:w="{col_width}"/>' * len(headers)
+    append_body_xml(doc, (
+        '<w:tbl>'
+        '<w:tblPr><w:tblStyle w:val="TableGrid"/><w:tblW w:w="0" w:type="auto"/>'
+        f'{TBL_BORDERS_XML}</w:tblPr>'
+        f'<w:tblGrid>{grid}</w:tblGrid>'
+        f'<w:tr>{header_row}</w:tr>{body_rows}</w:tbl>'
+    ))
     
     doc.add_paragraph("\n")
     
     # === Quiz ===
     add_heading(doc, "II. QUIZ / EXAMINATION", 2)
-    doc.add_paragraph(f"General Instructions: Answer the following. Total Points: {tos_df['Point Value'].sum()}", style='Intense Quote')
+    doc.add_paragraph(f"General Instructions: Answer the following. Total Points: {total_points}", style='Intense Quote')
     
-    for item in quiz_items:
-        p = doc.add_paragraph()
-        p.add_run(f"{item['item_no']}. ").bold = True
-        p.add_run(item["text"])
+    append_body_xml(doc, "".join(
+        "<w:p>" + run_xml(f"{item['item_no']}. ", bold=True) + run_xml(item["text"]) + "</w:p>"
+        for item in quiz_items
+    ))
     
     # === Answer Key ===
     doc.add_page_break()
     add_heading(doc, "III. ANSWER KEY & RUBRICS", 2)
-    for item in quiz_items:
-        p = doc.add_paragraph()
-        p.add_run(f"{item['item_no']}. ").bold = True
-        p.add_run(item["answer"])
+    append_body_xml(doc, "".join(
+        "<w:p>" + run_xml(f"{item['item_no']}. ", bold=True) + run_xml(item["answer"]) + "</w:p>"
+        for item in quiz_items
+    ))
     
     # Footer
     footer = doc.sections[0].footer
@@ -265,6 +338,14 @@ def create_word_doc(tos_df, quiz_items, metadata):
     
     return doc
 
+# --- Serialize Word Document (cached as bytes; Document itself is not cacheable) ---
+@st.cache_data(show_spinner=False, max_entries=50, ttl=600)
+def build_docx_bytes(tos_df, quiz_items, metadata_tuple):
+    doc = create_word_doc(tos_df, quiz_items, dict(metadata_tuple))
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
 # ======================
 # STREAMLIT UI
 # ======================
@@ -293,10 +374,10 @@ with col1:
     st.subheader("📋 Input Assessment Details")
     
     grade = st.selectbox("Grade Level", ["Grade 7", "Grade 8", "Grade 9", "Grade 10"])
-    subject = st.selectbox("Subject", list(MELC_DATABASE.keys()))
+    subject = st.selectbox("Subject", _get_subjects())
     
     # Dynamic quarter options
-    quarters = list(MELC_DATABASE.get(subject, {}).get(grade, {}).keys())
+    quarters = _get_quarters(subject, grade)
     quarter = st.selectbox("Quarter", quarters if quarters else ["Q1", "Q2", "Q3", "Q4"])
     
     # Competency selection (multi-select from DB or free text)
@@ -304,10 +385,11 @@ with col1:
     use_sample = st.checkbox("✅ Use sample MELCs (recommended)", value=True)
     
     competencies = []
-    if use_sample and subject in MELC_DATABASE and grade in MELC_DATABASE[subject] and quarter in MELC_DATABASE[subject][grade]:
+    melcs = _MELC_FLAT.get((subject, grade, quarter))
+    if use_sample and melcs is not None:
         options = [
             f"{c['code']}: {c['desc']}" 
-            for c in MELC_DATABASE[subject][grade][quarter]
+            for c in melcs
         ]
         selected = st.multiselect(
             "Choose MELCs",
@@ -370,29 +452,24 @@ if "tos_df" in st.session_state:
         st.dataframe(st.session_state.tos_df, use_container_width=True)
     
     with tab2:
-        for item in st.session_state.quiz_items:
-            st.markdown(f"**{item['item_no']}.** {item['text']}")
-            with st.expander("💡 Sample Answer/Rubric"):
-                st.text(item["answer"])
+        # One markdown/text element each instead of one per item
+        st.markdown("\n\n".join(f"**{item['item_no']}.** {item['text']}" for item in st.session_state.quiz_items))
+        with st.expander("💡 Sample Answers/Rubrics"):
+            st.text("\n\n".join(f"{item['item_no']}. {item['answer'].rstrip()}" for item in st.session_state.quiz_items))
     
     with tab3:
         # Generate Word doc
-        doc = create_word_doc(
+        docx_bytes = build_docx_bytes(
             st.session_state.tos_df,
             st.session_state.quiz_items,
-            st.session_state.metadata
+            tuple(st.session_state.metadata.items())
         )
         
-        # Save to buffer
-        buffer = io.BytesIO()
-        doc.save(buffer)
-        buffer.seek(0)
-        
         filename = f"TOS_Quiz_{st.session_state.metadata['grade']}_{st.session_state.metadata['subject']}_Q{st.session_state.metadata['quarter']}.docx"
         
         st.download_button(
             label="📥 Download Word Document (.docx)",
-            data=buffer,
+            data=docx_bytes,
             file_name=filename,
             mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
             use_container_width=True